@@ -0,0 +1,72 @@
+# backend_produits/cache.py
+
+"""Cache des lectures chaudes (produits lus bien plus souvent qu'écrits).
+
+Avec REDIS_URL défini et le paquet ``redis`` installé, le cache est
+partagé entre instances ; sinon, repli sur un petit cache en mémoire du
+processus. Les deux exposent la même interface asynchrone
+get/set/delete/aclose.
+
+Attention au repli local sous plusieurs workers : l'invalidation à
+l'écriture n'atteint que le worker qui a traité l'écriture. Son TTL est
+donc borné à la même fenêtre que le Cache-Control envoyé aux clients —
+la péremption possible reste celle déjà annoncée. Pour une invalidation
+immédiate entre workers, configurer REDIS_URL.
+"""
+
+import os
+import time
+
+try:
+    import redis.asyncio as redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+# Durée de vie des entrées (secondes) — l'invalidation à l'écriture fait
+# le vrai travail, le TTL n'est qu'un filet de sécurité
+CACHE_TTL = 300
+
+# Plafond du cache local : aligné sur le max-age du Cache-Control (30 s),
+# car les autres workers ne voient pas l'invalidation à l'écriture
+LOCAL_CACHE_TTL = 30
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+
+class _LocalCache:
+    """Repli mono-instance : dictionnaire {clé: (expiration, valeur)}."""
+
+    def __init__(self, max_entries: int = 1024):
+        self._data = {}
+        self._max_entries = max_entries
+
+    async def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key, value, ex=CACHE_TTL):
+        ex = min(ex, LOCAL_CACHE_TTL)
+        if len(self._data) >= self._max_entries:
+            # Éviction grossière de l'entrée la plus ancienne
+            self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + ex, value)
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def aclose(self):
+        self._data.clear()
+
+
+def make_cache():
+    """Construit le cache : Redis si configuré, sinon cache local."""
+    if HAS_REDIS and REDIS_URL:
+        return redis.from_url(REDIS_URL)
+    return _LocalCache()
@@ -1,37 +1,215 @@
-from sqlalchemy.orm import Session
+"""Fonctions d'accès aux données pour les produits.
+
+Règle pour les lectures en liste : ne jamais accéder à un attribut de
+relation dans une boucle sans l'avoir déclaré dans le paramètre ``load=``
+de ``get_products`` — sinon chaque itération déclenche sa propre requête
+(problème N+1). ``selectinload`` émet une seule requête supplémentaire
+``WHERE parent_id IN (...)`` quel que soit le nombre de lignes.
+"""
+
+import time
+from collections import Counter
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 import models
 import schemas
 
-def get_product(db: Session, product_id: int):
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+# Énoncés chauds construits une seule fois au niveau module : leur forme
+# compilée est réutilisée via le cache de SQLAlchemy au lieu d'être
+# reconstruite à chaque appel
+_GET_BY_ID = select(models.Product).where(models.Product.id == bindparam("pid"))
+_DEL_BY_ID = (
+    delete(models.Product)
+    .where(models.Product.id == bindparam("pid"))
+    .returning(models.Product.image)
+)
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Product).offset(skip).limit(limit).all()
+async def _acquire_image(db: AsyncSession, url: str, count: int = 1):
+    """Incrémente le compteur de références de l'image (créé au besoin).
 
-def create_product(db: Session, product: schemas.ProductCreate):
-    db_product = models.Product(
-        name=product.name,
-        description=product.description,
-        price=product.price,
-        image=product.image  # ✅ Ajout de l'image
+    Upsert atomique : deux uploads concurrents du même contenu — le cas
+    même que la déduplication vise — ne peuvent pas entrer en conflit
+    d'insertion.
+    """
+    insert_for = (
+        pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
     )
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    stmt = insert_for(models.ImageRef).values(path=url, refs=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.ImageRef.path],
+        set_={"refs": models.ImageRef.refs + count},
+    )
+    await db.execute(stmt)
+
+async def _release_image(db: AsyncSession, url: str):
+    """Décrémente le compteur ; retourne l'URL si plus rien ne la référence."""
+    result = await db.execute(
+        update(models.ImageRef)
+        .where(models.ImageRef.path == url)
+        .values(refs=models.ImageRef.refs - 1)
+        .returning(models.ImageRef.refs)
+    )
+    refs = result.scalar_one_or_none()
+    if refs is None:
+        # Image d'avant la déduplication, jamais comptée : orpheline
+        return url
+    if refs <= 0:
+        await db.execute(
+            delete(models.ImageRef).where(models.ImageRef.path == url)
+        )
+        return url
+    return None
+
+_CATALOG_VERSION = select(
+    func.max(models.Product.version), func.count(models.Product.id)
+)
+
+async def get_catalog_version(db: AsyncSession):
+    """Retourne (version max, nombre de produits) — change à chaque écriture."""
+    result = await db.execute(_CATALOG_VERSION)
+    return result.one()
 
-def update_product(db: Session, product_id: int, product: schemas.ProductCreate):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product:
-        db_product.name = product.name
-        db_product.description = product.description
-        db_product.price = product.price
-        db_product.image = product.image  # ✅ Ajout de la mise à jour de l'image
-        db.commit()
-        db.refresh(db_product)
+async def get_product(db: AsyncSession, product_id: int):
+    result = await db.execute(_GET_BY_ID, {"pid": product_id})
+    return result.scalar_one_or_none()
+
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, load=()):
+    # ``load`` : noms des relations à charger en batch (voir docstring du
+    # module). Tant qu'aucune relation n'est demandée, on garde la sélection
+    # Core des seules colonnes nécessaires : pas d'instances ORM complètes à
+    # matérialiser pour la simple liste (beaucoup moins de CPU par ligne)
+    if load:
+        opts = [selectinload(getattr(models.Product, name)) for name in load]
+        stmt = (
+            select(models.Product)
+            .options(*opts)
+            .offset(skip)
+            .limit(limit)
+        )
+        result = await db.execute(stmt)
+        return result.scalars().all()
+
+    stmt = (
+        select(
+            models.Product.id,
+            models.Product.name,
+            models.Product.description,
+            models.Product.price,
+            models.Product.image,
+        )
+        .offset(skip)
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return result.all()
+
+async def create_product(db: AsyncSession, product: schemas.ProductCreate):
+    # INSERT ... RETURNING : la ligne créée revient avec l'insertion, pas de
+    # SELECT de relecture (ce que faisait db.refresh)
+    stmt = (
+        insert(models.Product)
+        .values(
+            name=product.name,
+            description=product.description,
+            price=product.price,
+            image=product.image,
+        )
+        .returning(models.Product)
+    )
+    result = await db.execute(stmt)
+    db_product = result.scalar_one()
+    # Le compteur de références suit l'insertion dans la même transaction
+    if product.image:
+        await _acquire_image(db, product.image)
+    await db.commit()
     return db_product
 
-def delete_product(db: Session, product_id: int):
-    success = db.query(models.Product).filter(models.Product.id == product_id).delete()
-    db.commit()
-    return success > 0
+async def create_products(db: AsyncSession, products: list[schemas.ProductCreate]):
+    """Insère plusieurs produits en un seul INSERT multi-lignes.
+
+    Une seule transaction et un seul aller-retour (executemany avec
+    RETURNING) au lieu d'un commit + fsync par produit. Retourne les ids
+    créés dans l'ordre d'entrée.
+    """
+    rows = [p.model_dump() for p in products]
+    # sort_by_parameter_order : RETURNING ne garantit pas l'ordre des lignes
+    # par lui-même, SQLAlchemy réaligne les ids sur l'ordre des paramètres
+    result = await db.execute(
+        insert(models.Product).returning(
+            models.Product.id, sort_by_parameter_order=True
+        ),
+        rows,
+    )
+    ids = result.scalars().all()
+    # Compteurs de références des images, groupés par URL
+    counts = Counter(p.image for p in products if p.image)
+    for url, n in counts.items():
+        await _acquire_image(db, url, count=n)
+    await db.commit()
+    return ids
+
+async def update_product(db: AsyncSession, product_id: int, product: schemas.ProductCreate, set_image: bool = True):
+    """Met à jour un produit en un seul UPDATE ... RETURNING.
+
+    Avec ``set_image=False`` la colonne image n'est pas touchée (aucune
+    nouvelle image fournie) et l'écriture tient en un seul aller-retour.
+    Retourne ``(produit, image_orpheline)`` : le second élément est l'URL de
+    l'ancienne image si plus aucun produit ne la référence (à supprimer du
+    disque par l'appelant), sinon None. ``(None, None)`` si le produit
+    n'existe pas.
+    """
+    values = {
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "version": time.time_ns(),
+    }
+    old_image = None
+    if set_image:
+        # L'ancienne image est nécessaire pour ajuster les compteurs
+        result = await db.execute(
+            select(models.Product.image).where(models.Product.id == product_id)
+        )
+        old_image = result.scalar_one_or_none()
+        values["image"] = product.image
+
+    stmt = (
+        update(models.Product)
+        .where(models.Product.id == product_id)
+        .values(**values)
+        .returning(models.Product)
+    )
+    result = await db.execute(stmt)
+    db_product = result.scalar_one_or_none()
+    if db_product is None:
+        await db.rollback()
+        return None, None
+
+    orphan = None
+    if set_image and old_image != product.image:
+        if product.image:
+            await _acquire_image(db, product.image)
+        if old_image:
+            orphan = await _release_image(db, old_image)
+    await db.commit()
+    return db_product, orphan
+
+async def delete_product(db: AsyncSession, product_id: int):
+    """Supprime un produit.
+
+    Retourne ``(trouvé, image_orpheline)`` — l'URL n'est renvoyée que si
+    plus aucun produit ne référence l'image (fichier à supprimer).
+    """
+    # Un seul aller-retour : DELETE ... RETURNING renvoie le chemin de l'image
+    # (supporté par SQLite >= 3.35 et PostgreSQL)
+    result = await db.execute(_DEL_BY_ID, {"pid": product_id})
+    row = result.first()
+    orphan = None
+    if row is not None and row.image:
+        orphan = await _release_image(db, row.image)
+    await db.commit()
+    return row is not None, orphan
@@ -1,32 +1,79 @@
 # backend_produits/database.py
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 import os
 
-# URL de connexion (SQLite par défaut)
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+# URL de connexion : PostgreSQL en production (DATABASE_URL), SQLite
+# asynchrone par défaut pour le développement local
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./sql_app.db")
+
+# Render/Heroku fournissent une URL "postgresql://" : la réécrire pour asyncpg
+if SQLALCHEMY_DATABASE_URL.startswith("postgresql://"):
+    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
+        "postgresql://", "postgresql+asyncpg://", 1
+    )
 
-# Paramètres spécifiques pour SQLite
 connect_args = {}
+engine_kwargs = {}
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # Paramètres spécifiques pour SQLite
     connect_args = {"check_same_thread": False}
+else:
+    # PostgreSQL : pool dimensionné + recyclage, et cache d'énoncés préparés
+    # côté asyncpg pour ne pas re-parser le SQL à chaque requête
+    connect_args = {"statement_cache_size": 1024}
+    engine_kwargs = {
+        "pool_size": 20,
+        "max_overflow": 40,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+    if "prepared_statement_cache_size" not in SQLALCHEMY_DATABASE_URL:
+        sep = "&" if "?" in SQLALCHEMY_DATABASE_URL else "?"
+        SQLALCHEMY_DATABASE_URL += f"{sep}prepared_statement_cache_size=512"
 
-# Création du moteur
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+# Création du moteur asynchrone : les requêtes en attente de la base
+# n'occupent plus un thread du pool, elles rendent la main à l'event loop
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **engine_kwargs
 )
 
-# Création de la session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # Réglages appliqués à chaque connexion SQLite :
+    # - WAL : les lecteurs ne bloquent plus derrière l'écrivain
+    # - synchronous=NORMAL : fsync par checkpoint et non par commit
+    # - busy_timeout : attendre le verrou au lieu d'échouer immédiatement
+    # - temp_store/mmap/cache : tris en mémoire, lectures par mmap, 64 Mo de cache
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+# Création de la session (expire_on_commit=False : les objets restent
+# utilisables après commit sans re-SELECT implicite)
+SessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
+)
 
 # Classe de base pour les modèles
 Base = declarative_base()
 
-def init_db():
+async def init_db():
     """
     Initialise la base de données en créant toutes les tables définies dans models.py
     """
     import models  # ⚠️ IMPORTANT : importer les modèles avant la création
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # L'index trigramme sur products.name (gin_trgm_ops) exige
+            # l'extension pg_trgm ; la créer avant les tables
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.run_sync(Base.metadata.create_all)
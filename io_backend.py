@@ -0,0 +1,251 @@
+# backend_produits/io_backend.py
+
+"""Backend d'écriture disque pour les images uploadées.
+
+Quand le paquet ``liburing`` est disponible (Linux), les écritures sont
+soumises à io_uring par un thread démon propriétaire de l'anneau : les
+blocs de plusieurs uploads concurrents sont regroupés en un seul
+``io_uring_submit`` au lieu d'un syscall ``write`` chacun. Sans
+``liburing``, on retombe sur ``aiofiles`` — même comportement, moins de
+débit sous forte concurrence.
+"""
+
+import asyncio
+import ctypes
+import errno
+import os
+import queue
+import threading
+
+import aiofiles
+
+try:
+    from liburing import (
+        io_uring,
+        io_uring_cqe,
+        io_uring_cqe_seen,
+        io_uring_get_sqe,
+        io_uring_prep_write,
+        io_uring_queue_exit,
+        io_uring_queue_init,
+        io_uring_submit,
+        io_uring_wait_cqe,
+    )
+    HAS_LIBURING = True
+except ImportError:
+    HAS_LIBURING = False
+
+# Profondeur de l'anneau et nombre max de SQEs regroupés par soumission
+_QUEUE_DEPTH = 256
+_BATCH_MAX = 32
+
+# Au-delà de ce seuil, on écrit en O_DIRECT pour ne pas polluer le page
+# cache (qui sert aussi le fichier SQLite) ; en dessous, le cache est un
+# gain net pour les relectures
+DIRECT_THRESHOLD = 2 << 20  # 2 Mo
+_ALIGNMENT = 4096  # O_DIRECT exige adresse, offset et taille alignés
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class _WriteJob:
+    """Une écriture en attente : (fd, données, offset) + signal de fin."""
+
+    __slots__ = ("fd", "data", "offset", "loop", "event", "error")
+
+    def __init__(self, fd, data, offset, loop):
+        self.fd = fd
+        self.data = data
+        self.offset = offset
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.error = None
+
+
+class UringWriter:
+    """Thread démon qui possède l'anneau io_uring et sert les écritures.
+
+    Les handlers déposent leurs blocs dans une file ; le thread regroupe
+    jusqu'à ``_BATCH_MAX`` SQEs par ``io_uring_submit`` puis signale chaque
+    complétion via l'``asyncio.Event`` du job (``call_soon_threadsafe``,
+    l'event loop n'est jamais touché depuis le thread directement).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="uring-writer"
+        )
+        self._thread.start()
+
+    async def write(self, fd: int, data, offset: int):
+        if self._error is not None:
+            raise OSError(f"io_uring writer indisponible: {self._error}")
+        job = _WriteJob(fd, memoryview(data), offset, asyncio.get_running_loop())
+        self._queue.put(job)
+        await job.event.wait()
+        if job.error is not None:
+            raise job.error
+
+    @staticmethod
+    def _fail(job, error):
+        job.error = error
+        job.loop.call_soon_threadsafe(job.event.set)
+
+    def _run(self):
+        try:
+            self._serve()
+        except Exception as exc:  # anneau inutilisable (init ou soumission)
+            # Échouer les jobs en attente et tous les futurs plutôt que de
+            # les laisser attendre un event jamais signalé
+            self._error = exc
+            while True:
+                self._fail(self._queue.get(), OSError(f"io_uring writer indisponible: {exc}"))
+
+    def _serve(self):
+        ring = io_uring()
+        io_uring_queue_init(_QUEUE_DEPTH, ring, 0)
+        cqe = io_uring_cqe()
+        carry = []   # écritures partielles à resoumettre
+        batch = []
+        pending = set()
+        try:
+            while True:
+                # Reprendre d'abord les restes d'écritures partielles, puis
+                # bloquer sur le premier job et vider la file sans attendre :
+                # tout ce qui est arrivé entre-temps part dans la même soumission
+                batch = carry[:_BATCH_MAX]
+                carry = carry[len(batch):]
+                if not batch:
+                    batch.append(self._queue.get())
+                while len(batch) < _BATCH_MAX:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                pending = set(range(len(batch)))
+                for i, job in enumerate(batch):
+                    sqe = io_uring_get_sqe(ring)
+                    io_uring_prep_write(sqe, job.fd, job.data, len(job.data), job.offset)
+                    sqe.user_data = i
+                io_uring_submit(ring)
+
+                for _ in batch:
+                    io_uring_wait_cqe(ring, cqe)
+                    idx = cqe.user_data
+                    job = batch[idx]
+                    res = cqe.res
+                    io_uring_cqe_seen(ring, cqe)
+                    pending.discard(idx)
+                    if res < 0:
+                        self._fail(job, OSError(-res, os.strerror(-res)))
+                    elif res < len(job.data):
+                        # Écriture courte : resoumettre le reste au prochain tour
+                        job.data = job.data[res:]
+                        job.offset += res
+                        carry.append(job)
+                    else:
+                        job.loop.call_soon_threadsafe(job.event.set)
+                batch = []
+        except BaseException as exc:
+            # Ne pas laisser en plan les jobs soumis ou à resoumettre
+            for idx in pending:
+                self._fail(batch[idx], OSError(f"io_uring writer indisponible: {exc}"))
+            for job in carry:
+                self._fail(job, OSError(f"io_uring writer indisponible: {exc}"))
+            raise
+        finally:
+            io_uring_queue_exit(ring)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> UringWriter:
+    # Instanciation paresseuse : pas de thread tant qu'aucun upload n'arrive
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = UringWriter()
+        return _writer
+
+
+def _alloc_aligned(size: int):
+    """Alloue ``size`` octets alignés sur _ALIGNMENT via posix_memalign."""
+    ptr = ctypes.c_void_p()
+    rc = _libc.posix_memalign(ctypes.byref(ptr), _ALIGNMENT, size)
+    if rc != 0:
+        raise MemoryError(os.strerror(rc))
+    return ptr
+
+
+def _write_direct_sync(file_path: str, view, padded: int, real_size: int):
+    # Écriture O_DIRECT bloquante, appelée depuis un thread. La taille écrite
+    # doit être un multiple de l'alignement ; on retaille ensuite le fichier
+    # à sa taille réelle pour couper le remplissage
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o644)
+    try:
+        os.write(fd, view[:padded])
+        os.ftruncate(fd, real_size)
+    finally:
+        os.close(fd)
+
+
+async def _write_direct(file_path: str, upload_file, size: int, chunk_size: int, hasher=None):
+    """Draine l'upload dans un tampon aligné puis l'écrit en O_DIRECT."""
+    padded = (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+    ptr = _alloc_aligned(padded)
+    try:
+        buf = (ctypes.c_char * padded).from_address(ptr.value)
+        pos = 0
+        while chunk := await upload_file.read(chunk_size):
+            if hasher is not None:
+                hasher.update(chunk)
+            buf[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        ctypes.memset(ptr.value + pos, 0, padded - pos)
+
+        view = memoryview(buf)
+        try:
+            await asyncio.to_thread(_write_direct_sync, file_path, view, padded, pos)
+        except OSError as exc:
+            # tmpfs/NFS refusent O_DIRECT (EINVAL) : repli en écriture bufferisée
+            if exc.errno != errno.EINVAL:
+                raise
+            async with aiofiles.open(file_path, "wb") as f:
+                await f.write(bytes(view[:pos]))
+    finally:
+        _libc.free(ptr)
+
+
+async def write_upload(file_path: str, upload_file, chunk_size: int, hasher=None):
+    """Écrit le contenu d'un UploadFile à ``file_path`` bloc par bloc.
+
+    Si ``hasher`` est fourni, chaque bloc le met à jour au passage : le
+    contenu n'est lu qu'une seule fois même quand l'appelant veut son
+    empreinte.
+    """
+    size = getattr(upload_file, "size", None)
+    if size and size >= DIRECT_THRESHOLD:
+        await _write_direct(file_path, upload_file, size, chunk_size, hasher=hasher)
+    elif HAS_LIBURING:
+        writer = _get_writer()
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            offset = 0
+            while chunk := await upload_file.read(chunk_size):
+                if hasher is not None:
+                    hasher.update(chunk)
+                await writer.write(fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            os.close(fd)
+    else:
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await upload_file.read(chunk_size):
+                if hasher is not None:
+                    hasher.update(chunk)
+                await buffer.write(chunk)
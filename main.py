@@ -1,32 +1,74 @@
 # backend_produits/main.py
 
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Request, Response, BackgroundTasks
+import hashlib
 from typing import List, Optional
-from sqlalchemy.orm import Session
-from fastapi.responses import JSONResponse
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import JSONResponse, ORJSONResponse
+import orjson
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
-import uuid
-import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # Imports pour votre projet
+import cache as cache
 import crud as crud
+import io_backend as io_backend
 import models as models
 import schemas as schemas
-from database import SessionLocal, engine
+from database import SessionLocal, init_db
 
-models.Base.metadata.create_all(bind=engine)
+# orjson (extension C) sérialise le JSON plusieurs fois plus vite que le
+# json.dumps par défaut
+app = FastAPI(
+    title="Application de gestion des produits",
+    default_response_class=ORJSONResponse,
+)
+
+# Gestion centralisée des erreurs SQLAlchemy : remplace les try/except
+# répétés dans chaque route (et leur frame Python par appel)
+@app.exception_handler(SQLAlchemyError)
+async def sqlalchemy_error_handler(request: Request, exc: SQLAlchemyError):
+    return ORJSONResponse(
+        status_code=500,
+        content={"detail": "Erreur base de données"},
+    )
 
-app = FastAPI(title="Application de gestion des produits")
+# Créer les tables au démarrage (le moteur est asynchrone, impossible
+# de le faire au niveau module) et ouvrir le pool de processus partagé
+# pour le travail CPU (validation d'images) : sous le GIL, ce travail
+# bloquerait l'event loop
+@app.on_event("startup")
+async def on_startup():
+    await init_db()
+    app.state.cpu_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    app.state.cache = cache.make_cache()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.cpu_pool.shutdown()
+    await app.state.cache.aclose()
 
 # Créer le dossier uploads s'il n'existe pas
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Servir les fichiers statiques (images)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Servir les fichiers statiques (images) — réservé au développement.
+# En production, mettre SERVE_UPLOADS=0 et laisser Nginx servir /uploads
+# directement via sendfile (voir deploy/nginx.conf) : chaque octet d'image
+# servi par Python passe par l'event loop et concurrence les requêtes API
+if os.getenv("SERVE_UPLOADS", "1") == "1":
+    app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+# Compresser les réponses d'au moins 1 Ko (les listes de produits
+# surtout) : moins d'octets sur le réseau pour quelques µs de CPU
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Configuration CORS améliorée
 app.add_middleware(
@@ -52,173 +94,321 @@ def read_root():
     return {"message": "Bienvenue dans l'application de gestion des produits!"}
 
 # Dépendance pour la base de données
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
+
+# Taille d'un bloc de lecture : borne la mémoire par upload et rend la main
+# à l'event loop entre chaque bloc
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 Mo
+
+# Signatures des formats d'image acceptés (octets magiques)
+_IMAGE_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"\xff\xd8\xff",       # JPEG
+    b"GIF87a", b"GIF89a",  # GIF
+    b"RIFF",               # WebP
+    b"BM",                 # BMP
+)
+
+def _sniff_image(header: bytes) -> bool:
+    """Vérifie les octets magiques du fichier.
+
+    Exécutée dans le pool de processus : c'est le point d'accueil de toute
+    validation CPU plus lourde (Pillow verify, miniatures) sans bloquer
+    l'event loop.
+    """
+    return header.startswith(_IMAGE_SIGNATURES)
+
+async def validate_image(upload_file: UploadFile) -> bool:
+    """Valide le contenu de l'image dans le pool de processus partagé."""
+    header = await upload_file.read(16)
+    await upload_file.seek(0)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.cpu_pool, _sniff_image, header)
+
+class _AsyncReader:
+    """Adapte un fichier synchrone à l'interface read() attendue par io_backend."""
+
+    def __init__(self, f, size=None):
+        self._f = f
+        self.size = size
+
+    async def read(self, n: int) -> bytes:
+        return await asyncio.to_thread(self._f.read, n)
+
+async def _stage_upload(upload_file: UploadFile):
+    """Draine l'upload dans un tampon temporaire en calculant son empreinte.
+
+    Le contenu reste en mémoire jusqu'à 1 Mo (SpooledTemporaryFile) ; le nom
+    final est dérivé de l'empreinte. Retourne ``(url, tampon, taille)``.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    temp = tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE)
+    size = 0
+    try:
+        while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+            temp.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        temp.close()
+        raise
+    finally:
+        await upload_file.close()
+
+    file_extension = os.path.splitext(upload_file.filename)[1]
+    return f"/uploads/{hasher.hexdigest()}{file_extension}", temp, size
+
+async def _finalize_image(temp, file_path: str, size: int):
+    """Persiste l'image mise en attente (exécuté après l'envoi de la réponse).
+
+    Même contenu => même nom : si le fichier existe déjà (déduplication),
+    il n'y a rien à écrire.
+    """
+    try:
+        if not os.path.exists(file_path):
+            temp.seek(0)
+            await io_backend.write_upload(file_path, _AsyncReader(temp, size), UPLOAD_CHUNK_SIZE)
     finally:
-        db.close()
+        temp.close()
 
 # Fonction pour sauvegarder l'image
-async def save_upload_file(upload_file: UploadFile) -> str:
-    """Sauvegarde le fichier uploadé et retourne l'URL"""
-    if upload_file.filename:
-        # Générer un nom unique pour éviter les conflits
-        file_extension = os.path.splitext(upload_file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Sauvegarder le fichier
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-        
-        # Retourner l'URL relative
-        return f"/uploads/{unique_filename}"
-    return None
+async def save_upload_file(upload_file: UploadFile, background: BackgroundTasks) -> str:
+    """Met l'image en attente, programme sa persistance en tâche de fond
+    et retourne immédiatement l'URL : le client n'attend plus l'écriture
+    disque, seulement l'écriture en base"""
+    if not upload_file.filename:
+        return None
+
+    url, temp, size = await _stage_upload(upload_file)
+    file_path = os.path.join(UPLOAD_DIR, url.replace("/uploads/", ""))
+    background.add_task(_finalize_image, temp, file_path, size)
+    return url
 
 # Créer un produit avec upload d'image
 @app.post("/products/", response_model=schemas.Product)
 async def create_product(
+    background: BackgroundTasks,
     name: str = Form(...),
     description: Optional[str] = Form(None),
     price: float = Form(...),
     image: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Créer un nouveau produit avec image optionnelle"""
-    try:
-        # Validation de l'image si fournie
-        image_url = None
-        if image and image.filename:
-            # Vérifier le type de fichier
-            if not image.content_type.startswith('image/'):
-                raise HTTPException(status_code=400, detail="Le fichier doit être une image")
-            
-            # Vérifier la taille (max 5MB)
-            if image.size and image.size > 5 * 1024 * 1024:
-                raise HTTPException(status_code=400, detail="L'image ne doit pas dépasser 5MB")
-            
-            # Sauvegarder l'image
-            image_url = await save_upload_file(image)
-        
-        # Créer l'objet produit
-        product_data = schemas.ProductCreate(
-            name=name,
-            description=description or "",
-            price=price,
-            image=image_url
+    # Validation de l'image si fournie
+    image_url = None
+    if image and image.filename:
+        # Vérifier le type de fichier
+        if not image.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Le fichier doit être une image")
+
+        # Vérifier le contenu réel (octets magiques), hors event loop
+        if not await validate_image(image):
+            raise HTTPException(status_code=400, detail="Le contenu du fichier n'est pas une image valide")
+
+        # Vérifier la taille (max 5MB)
+        if image.size and image.size > 5 * 1024 * 1024:
+            raise HTTPException(status_code=400, detail="L'image ne doit pas dépasser 5MB")
+
+        # Mettre l'image en attente (persistée après la réponse)
+        image_url = await save_upload_file(image, background)
+
+    # Créer l'objet produit
+    product_data = schemas.ProductCreate(
+        name=name,
+        description=description or "",
+        price=price,
+        image=image_url
+    )
+
+    # Créer le produit en base
+    return await crud.create_product(db=db, product=product_data)
+
+# Taille maximale d'un lot : borne le travail par requête
+MAX_BATCH_SIZE = 1000
+
+# Créer plusieurs produits en un seul appel
+@app.post("/products/batch")
+async def create_products_batch(
+    items: List[schemas.ProductCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """Créer un lot de produits en une seule transaction (sans image uploadée)"""
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Lot trop grand (max {MAX_BATCH_SIZE} produits)"
         )
-        
-        # Créer le produit en base
-        created_product = crud.create_product(db=db, product=product_data)
-        return created_product
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la création: {str(e)}")
+    ids = [] if not items else await crud.create_products(db, items)
+    return {"created": len(ids), "ids": list(ids)}
 
 # Lire tous les produits
 @app.get("/products/", response_model=List[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    try:
-        products = crud.get_products(db, skip=skip, limit=limit)
-        return products
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération: {str(e)}")
+async def read_products(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_db)
+):
+    # ETag dérivé de la version max du catalogue : si rien n'a changé,
+    # on répond 304 sans requêter ni sérialiser la liste
+    max_version, count = await crud.get_catalog_version(db)
+    etag = '"{}"'.format(
+        hashlib.blake2b(
+            f"{max_version}:{count}:{skip}:{limit}".encode(), digest_size=16
+        ).hexdigest()
+    )
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=30, stale-while-revalidate=60",
+    }
+
+    # La version du catalogue fait partie de la clé : toute écriture rend
+    # l'entrée inaccessible, pas besoin d'invalidation explicite ici
+    cache_key = f"ps:{skip}:{limit}:{max_version}:{count}"
+    raw = await app.state.cache.get(cache_key)
+    if raw is not None:
+        return Response(raw, media_type="application/json", headers=headers)
+
+    rows = await crud.get_products(db, skip=skip, limit=limit)
+    # Sérialisation directe des lignes : les données viennent de la base,
+    # elles n'ont pas besoin d'être revalidées par Pydantic
+    body = orjson.dumps([dict(r._mapping) for r in rows])
+    await app.state.cache.set(cache_key, body, ex=cache.CACHE_TTL)
+    return Response(body, media_type="application/json", headers=headers)
 
 # Lire un produit par ID
 @app.get("/products/{product_id}", response_model=schemas.Product)
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    try:
-        db_product = crud.get_product(db, product_id=product_id)
-        if db_product is None:
-            raise HTTPException(status_code=404, detail="Produit non trouvé")
-        return db_product
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération: {str(e)}")
+async def read_product(
+    product_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db)
+):
+    cache_control = "public, max-age=30, stale-while-revalidate=60"
+
+    # Lecture chaude : tenter le cache avant la base
+    cache_key = f"p:{product_id}"
+    raw = await app.state.cache.get(cache_key)
+    if raw is not None:
+        entry = orjson.loads(raw)
+        etag = '"{}"'.format(entry["version"])
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304)
+        return ORJSONResponse(
+            entry["body"],
+            headers={"ETag": etag, "Cache-Control": cache_control},
+        )
+
+    db_product = await crud.get_product(db, product_id=product_id)
+    if db_product is None:
+        raise HTTPException(status_code=404, detail="Produit non trouvé")
+
+    # Remplir le cache avec la version (pour l'ETag) et le corps sérialisé
+    body = {
+        "id": db_product.id,
+        "name": db_product.name,
+        "description": db_product.description,
+        "price": db_product.price,
+        "image": db_product.image,
+    }
+    await app.state.cache.set(
+        cache_key,
+        orjson.dumps({"version": db_product.version, "body": body}),
+        ex=cache.CACHE_TTL,
+    )
+
+    # La version de la ligne sert directement d'ETag
+    etag = f'"{db_product.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return db_product
 
 # Modifier un produit avec image
 @app.put("/products/{product_id}", response_model=schemas.Product)
 async def update_product(
     product_id: int,
+    background: BackgroundTasks,
     name: str = Form(...),
     description: Optional[str] = Form(None),
     price: float = Form(...),
     image: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Modifier un produit existant avec image optionnelle"""
-    try:
-        # Vérifier que le produit existe
-        existing_product = crud.get_product(db, product_id=product_id)
-        if existing_product is None:
-            raise HTTPException(status_code=404, detail="Produit non trouvé")
-        
-        # Traitement de l'image si fournie
-        image_url = existing_product.image  # Garder l'ancienne image par défaut
-        if image and image.filename:
-            # Vérifier le type de fichier
-            if not image.content_type.startswith('image/'):
-                raise HTTPException(status_code=400, detail="Le fichier doit être une image")
-            
-            # Vérifier la taille
-            if image.size and image.size > 5 * 1024 * 1024:
-                raise HTTPException(status_code=400, detail="L'image ne doit pas dépasser 5MB")
-            
-            # Supprimer l'ancienne image si elle existe
-            if existing_product.image:
-                old_image_path = existing_product.image.replace("/uploads/", "")
-                old_file_path = os.path.join(UPLOAD_DIR, old_image_path)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-            
-            # Sauvegarder la nouvelle image
-            image_url = await save_upload_file(image)
-        
-        # Créer l'objet de mise à jour
-        product_data = schemas.ProductCreate(
-            name=name,
-            description=description or "",
-            price=price,
-            image=image_url
-        )
-        
-        # Mettre à jour le produit
-        updated_product = crud.update_product(db, product_id=product_id, product=product_data)
-        if updated_product is None:
-            raise HTTPException(status_code=404, detail="Échec de la mise à jour")
-        
-        return updated_product
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la mise à jour: {str(e)}")
+    # Traitement de l'image si fournie ; sans nouvelle image, la colonne
+    # n'est pas touchée et la mise à jour tient en un seul UPDATE
+    new_image = bool(image and image.filename)
+    image_url = None
+    if new_image:
+        # Vérifier le type de fichier
+        if not image.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Le fichier doit être une image")
+
+        # Vérifier le contenu réel (octets magiques), hors event loop
+        if not await validate_image(image):
+            raise HTTPException(status_code=400, detail="Le contenu du fichier n'est pas une image valide")
+
+        # Vérifier la taille
+        if image.size and image.size > 5 * 1024 * 1024:
+            raise HTTPException(status_code=400, detail="L'image ne doit pas dépasser 5MB")
+
+        # Mettre la nouvelle image en attente (l'ancienne n'est supprimée
+        # que si plus aucun produit ne la référence, voir plus bas)
+        image_url = await save_upload_file(image, background)
+
+    # Créer l'objet de mise à jour
+    product_data = schemas.ProductCreate(
+        name=name,
+        description=description or "",
+        price=price,
+        image=image_url
+    )
+
+    # Mettre à jour le produit (UPDATE ... RETURNING, 404 si absent)
+    updated_product, orphan_image = await crud.update_product(
+        db, product_id=product_id, product=product_data, set_image=new_image
+    )
+    if updated_product is None:
+        raise HTTPException(status_code=404, detail="Produit non trouvé")
+
+    # Invalider l'entrée de cache après le commit
+    await app.state.cache.delete(f"p:{product_id}")
+
+    # Supprimer l'ancienne image si plus aucun produit ne la référence
+    if orphan_image:
+        orphan_path = os.path.join(UPLOAD_DIR, orphan_image.replace("/uploads/", ""))
+        if os.path.exists(orphan_path):
+            os.remove(orphan_path)
+
+    return updated_product
 
 # Supprimer un produit
 @app.delete("/products/{product_id}")
-def delete_product(product_id: int, db: Session = Depends(get_db)):
-    try:
-        # Récupérer le produit pour supprimer son image
-        existing_product = crud.get_product(db, product_id=product_id)
-        if existing_product and existing_product.image:
-            image_path = existing_product.image.replace("/uploads/", "")
-            file_path = os.path.join(UPLOAD_DIR, image_path)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
-        # Supprimer le produit de la base
-        success = crud.delete_product(db, product_id=product_id)
-        if not success:
-            raise HTTPException(status_code=404, detail="Produit non trouvé")
-        
-        return JSONResponse(content={"message": "Produit supprimé avec succès"})
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la suppression: {str(e)}")
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    # Supprimer le produit de la base (un seul aller-retour, l'image est
+    # renvoyée par le DELETE ... RETURNING)
+    found, orphan_image = await crud.delete_product(db, product_id=product_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Produit non trouvé")
+
+    # Invalider l'entrée de cache après le commit
+    await app.state.cache.delete(f"p:{product_id}")
+
+    # Supprimer le fichier image seulement s'il n'est plus référencé
+    if orphan_image:
+        file_path = os.path.join(UPLOAD_DIR, orphan_image.replace("/uploads/", ""))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    return JSONResponse(content={"message": "Produit supprimé avec succès"})
 
 # Route pour tester l'upload
 @app.post("/test-upload/")
@@ -232,4 +422,15 @@ async def test_upload(file: UploadFile = File(...)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # 2n+1 workers pour occuper tous les cœurs, boucle uvloop (libuv) et
+    # parseur HTTP httptools ; journal d'accès coupé (un write() par requête)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=2 * (os.cpu_count() or 1) + 1,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+        access_log=False,
+    )
\ No newline at end of file
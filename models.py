@@ -1,13 +1,45 @@
 # backend_produits/models.py
 
-from sqlalchemy import Column, Integer, String, Float, Text
+import time
+
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Text, Index
 from database import Base
 
 class Product(Base):
     __tablename__ = "products"
-    
+
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(255), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     price = Column(Float, nullable=False)
-    image = Column(String(500), nullable=True)  # URL de l'image
\ No newline at end of file
+    image = Column(String(500), nullable=True)  # URL de l'image
+    # Horodatage ns de la dernière écriture : sert d'ETag par produit, et
+    # max(version) sert d'ETag de liste (monotone croissant).
+    # BigInteger : time_ns() dépasse largement un int4 PostgreSQL
+    version = Column(BigInteger, nullable=False, default=time.time_ns)
+
+    __table_args__ = (
+        # Filtres par plage de prix (price BETWEEN ...)
+        Index("ix_products_price", "price"),
+        # Recherche ILIKE sur le nom : un index trigramme GIN sert les motifs
+        # '%...%', contrairement au btree (PostgreSQL uniquement, nécessite
+        # l'extension pg_trgm ; les autres dialectes créent un index simple)
+        Index(
+            "ix_products_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
+class ImageRef(Base):
+    """Compteur de références d'une image dédupliquée.
+
+    Les fichiers sont nommés d'après l'empreinte de leur contenu : deux
+    produits peuvent partager la même image. On ne supprime le fichier
+    que quand son compteur retombe à zéro.
+    """
+    __tablename__ = "image_refs"
+
+    path = Column(String(500), primary_key=True)  # URL /uploads/...
+    refs = Column(Integer, nullable=False, default=0)